@@ -40,7 +40,7 @@ class Mico:
         self.gripperConstraints = []
         self.fakeGrippers = []
         self.gripperPositions = [
-            self.p.getJointState(self.armId, i)[0] for i in [7, 9]
+            state[0] for state in self.p.getJointStates(self.armId, [7, 9])
         ]
 
         self.compute_ik_information()
@@ -136,13 +136,18 @@ class Mico:
 
     def ik_step(self):
         joint_poses = self.compute_ik_poses()
+        # Bind once, the physics client wrapper resolves attributes on every
+        # access.
+        set_joint_motor_control = self.p.setJointMotorControl2
+        arm_id = self.armId
+        position_control = self.p.POSITION_CONTROL
 
         # Set all body joints.
         for i in range(len(joint_poses)):
-            self.p.setJointMotorControl2(
-                bodyIndex=self.armId,
+            set_joint_motor_control(
+                bodyIndex=arm_id,
                 jointIndex=i,
-                controlMode=self.p.POSITION_CONTROL,
+                controlMode=position_control,
                 targetPosition=joint_poses[i],
                 targetVelocity=0,
                 force=500,
@@ -150,19 +155,19 @@ class Mico:
                 velocityGain=1)
 
         # Set gripper joints.
-        self.p.setJointMotorControl2(
-            bodyIndex=self.armId,
+        set_joint_motor_control(
+            bodyIndex=arm_id,
             jointIndex=7,
-            controlMode=self.p.POSITION_CONTROL,
+            controlMode=position_control,
             targetPosition=self.goalGripper,
             targetVelocity=0,
             force=500,
             positionGain=0.03,
             velocityGain=1)
-        self.p.setJointMotorControl2(
-            bodyIndex=self.armId,
+        set_joint_motor_control(
+            bodyIndex=arm_id,
             jointIndex=9,
-            controlMode=self.p.POSITION_CONTROL,
+            controlMode=position_control,
             targetPosition=self.goalGripper,
             targetVelocity=0,
             force=500,
@@ -170,14 +175,15 @@ class Mico:
             velocityGain=1)
 
         # Save whether the arm has reached IK goal.
+        joint_states = self.p.getJointStates(arm_id, list(range(10)))
         gripper_reached = [
-            abs(self.p.getJointState(self.armId, i)[0] - self.goalGripper) <
+            abs(joint_states[i][0] - self.goalGripper) <
             self.goalEpsilon for i in [7, 9]
         ]
         self.goalReached = all(gripper_reached) and all(
             map(
-                lambda joint: abs(self.p.getJointState(self.armId, joint)[
-                              0] - joint_poses[joint]) < self.goalEpsilon, range(6)
+                lambda joint: abs(joint_states[joint][0] - joint_poses[joint]) <
+                self.goalEpsilon, range(6)
             )
         )
 
@@ -186,7 +192,7 @@ class Mico:
         and create fake griper constraints if it did. """
         self.prevGripperPositions = self.gripperPositions
         self.gripperPositions = [
-            self.p.getJointState(self.armId, i)[0] for i in [7, 9]
+            state[0] for state in self.p.getJointStates(self.armId, [7, 9])
         ]
         if self.graspableObject is not None:
             points = self.p.getContactPoints(
@@ -205,7 +211,10 @@ class Mico:
 
     def get_joint_poses(self):
         """ Returns current joint poses."""
-        return [self.p.getJointState(self.armId, i)[0] for i in range(10)]
+        return [
+            state[0]
+            for state in self.p.getJointStates(self.armId, list(range(10)))
+        ]
 
     def init_gripper(self):
         """  Initialize objects on the gripper tips to anchor objects against. Note
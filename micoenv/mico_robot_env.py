@@ -1,4 +1,6 @@
+import functools
 import math
+import random
 import uuid
 import numpy as np
 from gym import spaces
@@ -13,7 +15,51 @@ tmp_dir = os.path.dirname(sys.modules['__main__'].__file__) + "/tmp"
 
 def goal_distance(goal_a, goal_b):
     assert goal_a.shape == goal_b.shape
-    return np.linalg.norm(goal_a - goal_b, axis=-1)
+    d = np.subtract(goal_a, goal_b)
+    return np.sqrt(np.einsum('...i,...i', d, d))
+
+
+def _dist_sq(a, b):
+    # Squared distance between two positions, without numpy dispatch.
+    return float((a[0] - b[0])**2 + (a[1] - b[1])**2 + (a[2] - b[2])**2)
+
+
+@functools.lru_cache(maxsize=64)
+def _noise_texture(mode, color):
+    # Generates a Perlin noise texture once per (mode, color) and returns its
+    # file name. color must be a hashable tuple, see pooled_texture.
+    from micoenv import perlin_noise as noise
+
+    return noise.createAndSave(
+        tmp_dir + "/{}-{}.png".format(mode, uuid.uuid4()),
+        mode,
+        np.array(color),
+    )
+
+
+def _sub3(a, b):
+    # Element-wise difference of two positions, kept as a tuple.
+    return (a[0] - b[0], a[1] - b[1], a[2] - b[2])
+
+
+def _pack_low_dim(grip_pos, goal, j7, j9, obj_pos, arm_goal_pos, arm_goal_grip,
+                  grip_velp, is_grasping, out):
+    # Writes the 22 element low dimensional state into out. obj_pos is None
+    # when there is no object, in which case its entries are zeroed.
+    out[0:3] = grip_pos
+    out[3:6] = goal
+    out[6] = j7
+    out[7] = j9
+    if obj_pos is None:
+        out[8:14] = 0
+    else:
+        out[8:11] = obj_pos
+        out[11:14] = _sub3(obj_pos, grip_pos)
+    out[14:17] = arm_goal_pos
+    out[17] = arm_goal_grip
+    out[18:21] = grip_velp
+    out[21] = is_grasping
+    return out
 
 
 class MicoEnv(BulletRobotEnv):
@@ -34,11 +80,15 @@ class MicoEnv(BulletRobotEnv):
             randomize_objects=False,
             randomize_camera=False,
             randomize_arm=False,
+            texture_pool_size=16,
     ):
         self.randomizeCamera = randomize_camera
         self.randomizeArm = randomize_arm
         self.envId = uuid.uuid4()
         self.randomizeTextures = randomize_textures
+        # Generated texture files, reused once texture_pool_size are made.
+        self.texturePoolSize = texture_pool_size
+        self.texturePool = {"wall": [], "table": []}
         self.has_object = has_object
         self.target_in_the_air = target_in_the_air
         self.normalTextures = normal_textures
@@ -47,13 +97,25 @@ class MicoEnv(BulletRobotEnv):
         self.low_dim_space = spaces.Box(
             -np.inf, np.inf, shape=(22,), dtype="float32")
         self.distance_threshold = distance_threshold
+        self._threshold_sq = distance_threshold**2
         self.reward_type = reward_type
+        # Rewards for missing and for reaching the goal.
+        self._miss_reward, self._hit_reward = {
+            "sparse": (-1, 3),
+            "positive": (0, 5),
+        }.get(reward_type, (None, None))
         self.height_offset = height_offset
-        self.table_low = [-0.35, -0.25, 0.05]
-        self.table_high = [-0.2, 0.25, 0.2]
+        self.table_low = np.array([-0.35, -0.25, 0.05])
+        self.table_high = np.array([-0.2, 0.25, 0.2])
         self._max_episode_steps = done_after
         self.observation_type = observation_type
         self.n_actions = 4
+        # Bullet query results for the current step, cleared in _step_callback.
+        self._cache = {}
+        self._low_dim_buf = np.empty(22, dtype=np.float32)
+        self._action_buf = np.empty(self.n_actions, dtype=np.float32)
+        # 10 joint poses, the gripper position and the arm IK goal.
+        self._aux_buf = np.empty(16, dtype=np.float32)
         super(MicoEnv, self).__init__(
             n_substeps=n_substeps,
             n_actions=self.n_actions,
@@ -61,63 +123,93 @@ class MicoEnv(BulletRobotEnv):
             observation_type=observation_type,
             done_after=done_after,
         )
-        self.goalShape = self.p.createCollisionShape(
-            self.p.GEOM_SPHERE, radius=0.03)
         self.reset()
         self.state_dim = self.state_vector().shape
-        high = np.inf * np.ones(self.state_dim)
+        high = np.full(self.state_dim, np.inf, dtype=np.float32)
         low = -high
-        aux_high = np.ones((16,)) * 10
-        self.state_space = spaces.Box(low, high)
-        self.aux_space = spaces.Box(-aux_high, aux_high)
+        aux_high = np.full(self._aux_buf.shape, 10, dtype=np.float32)
+        self.state_space = spaces.Box(low, high, dtype=np.float32)
+        self.aux_space = spaces.Box(-aux_high, aux_high, dtype=np.float32)
 
     def compute_reward(self, achieved_goal, desired_goal):
-        d = goal_distance(achieved_goal, desired_goal)
-        if self.reward_type == "sparse":
-            return 3 if (d < self.distance_threshold) else -1
-        elif self.reward_type == "positive":
-            return 5 if (d < self.distance_threshold) else 0
+        return self._reward(
+            _dist_sq(achieved_goal, desired_goal) < self._threshold_sq)
+
+    def _reward(self, reached):
+        return self._hit_reward if reached else self._miss_reward
+
+    def _step_metrics(self):
+        """ Returns (reward, success) for the current step. Both come from the
+        same distance to the goal, so it is computed once per step. """
+        metrics = self._cache.get("metrics")
+        if metrics is None:
+            if self.has_object:
+                pos = self._obj_pos()
+            else:
+                pos = self._grip_state()[0]
+            reached = _dist_sq(pos, self.goal) < self._threshold_sq
+            metrics = self._cache["metrics"] = (self._reward(reached), reached)
+        return metrics
 
     def _step_callback(self):
         self.arm.step_simulation()
+        self._cache = {}
+
+    def _grip_state(self):
+        """ Returns the gripper link state, queried at most once per step."""
+        grip_state = self._cache.get("grip_state")
+        if grip_state is None:
+            grip_state = self._cache["grip_state"] = self.p.getLinkState(
+                self.arm.armId, 6, computeLinkVelocity=1)
+        return grip_state
+
+    def _obj_pos(self):
+        """ Returns the object position, queried at most once per step."""
+        obj_pos = self._cache.get("obj_pos")
+        if obj_pos is None:
+            obj_pos = self._cache["obj_pos"] = \
+                self.p.getBasePositionAndOrientation(self.body)[0]
+        return obj_pos
+
+    def _gripper_joint_states(self):
+        """ Returns the states of both gripper joints in a single query."""
+        gripper_joints = self._cache.get("gripper_joints")
+        if gripper_joints is None:
+            gripper_joints = self._cache["gripper_joints"] = \
+                self.p.getJointStates(self.arm.armId, [7, 9])
+        return gripper_joints
 
     def _set_action(self, action):
         assert action.shape == (self.n_actions,)
-        action = np.clip(action, -1, 1)
-        action[3] = 0
-        action = (
-                action.copy() * 0.05
-        )
-        self.arm.apply_action(action)
+        # Mico.apply_action does not keep a reference to the action, so the
+        # same buffer can be reused every step.
+        buf = self._action_buf
+        buf[:] = action
+        np.clip(buf, -1, 1, out=buf)
+        buf[3] = 0
+        buf *= 0.05
+        self.arm.apply_action(buf)
 
     def state_vector(self):
-        grip_state = self.p.getLinkState(
-            self.arm.armId, 6, computeLinkVelocity=1)
-        grip_velp = np.array(grip_state[6])
-        grip_pos = np.array(grip_state[0])
-        if self.has_object:
-            obj_pos = np.array(
-                self.p.getBasePositionAndOrientation(self.body)[0])
-            object_rel_pos = obj_pos - grip_pos
-        else:
-            obj_pos = object_rel_pos = np.zeros((3,))
-        gripper_state = [
-            self.p.getJointState(self.arm.armId, 7)[0],
-            self.p.getJointState(self.arm.armId, 9)[0],
-        ]
-        is_grasping = 1 if self.arm.is_grasping() else 0
-        low_dim = np.concatenate([
-            grip_pos.copy(),
-            self.goal.copy(),
-            gripper_state.copy(),
+        grip_state = self._grip_state()
+        gripper_joints = self._gripper_joint_states()
+        obj_pos = self._obj_pos() if self.has_object else None
+        arm = self.arm
+        buf = self._low_dim_buf
+        _pack_low_dim(
+            grip_state[0],
+            self.goal,
+            gripper_joints[0][0],
+            gripper_joints[1][0],
             obj_pos,
-            object_rel_pos,
-            self.arm.goalPosition,
-            [self.arm.goalGripper],
-            grip_velp,
-            [is_grasping],
-        ])
-        return low_dim.astype(np.float32)
+            arm.goalPosition,
+            arm.goalGripper,
+            grip_state[6],
+            1 if arm.is_grasping() else 0,
+            buf,
+        )
+        # Callers keep (and demo policies modify) the returned states.
+        return buf.copy()
 
     def _get_obs(self):
         low_dim = self.state_vector()
@@ -156,13 +248,7 @@ class MicoEnv(BulletRobotEnv):
             if self.fixed_goal:
                 high[1] = 0.0
             self.goal = self._sample_goal()
-            obj_pos = self.np_random.uniform(self.table_low, high, size=3)
-            obj_pos[2] = self.height_offset
-            while goal_distance(obj_pos, self.goal) < 0.1:
-                # Recreate te object so it is far enough from the goal and the task
-                # is not immediately done.
-                obj_pos = self.np_random.uniform(self.table_low, high, size=3)
-                obj_pos[2] = self.height_offset
+            obj_pos = self._sample_obj_pos(high)
             arm_goal_pos = None
             should_be_grasping = False
             arm_goal_grip = None
@@ -170,7 +256,7 @@ class MicoEnv(BulletRobotEnv):
         self.p.resetSimulation()
         radius = 0.025
         if self.randomizeObjects:
-            radius = np.random.uniform(0.02, 0.03, 1)
+            radius = random.uniform(0.02, 0.03)
         self.goalShape = self.p.createCollisionShape(
             self.p.GEOM_SPHERE, radius=radius)
         self.visualizeTarget = self.p.createMultiBody(
@@ -192,15 +278,17 @@ class MicoEnv(BulletRobotEnv):
                 # Make the object some shade of red.
                 obj_color = np.random.uniform([0.7, 0.1, 0.1, 1],
                                               [1, 0.3, 0.3, 1], (4,))
-                obj_size = np.random.uniform(0.025, 0.04)
+                obj_size = random.uniform(0.025, 0.04)
             col_shape = self.p.createCollisionShape(
                 self.p.GEOM_BOX, halfExtents=[obj_size] * 3)
+            # Random rotation around z, as a quaternion in closed form.
+            half_angle = random.uniform(0, math.pi * 2) * 0.5
             self.body = self.p.createMultiBody(
                 baseMass=0.3,
                 baseCollisionShapeIndex=col_shape,
                 basePosition=obj_pos,
-                baseOrientation=self.p.getQuaternionFromEuler(
-                    [0, 0, np.random.uniform(0, math.pi * 2, 1)]),
+                baseOrientation=(0.0, 0.0, math.sin(half_angle),
+                                 math.cos(half_angle)),
             )
             self.originalObjPosition = obj_pos
 
@@ -214,16 +302,30 @@ class MicoEnv(BulletRobotEnv):
                 print("Warning: state reset failed")
                 return False
 
+        self._cache = {}
         if arm_goal_pos is not None:
             self.arm.goalPosition = arm_goal_pos
             self.arm.goalGripper = arm_goal_grip
         self.originalGoalPosition = self.goal.copy()
-        grip_state = self.p.getLinkState(
-            self.arm.armId, 6, computeLinkVelocity=1)
+        grip_state = self._grip_state()
         grip_pos = np.array(grip_state[0])
         self.originalGripPosition = grip_pos
         return True
 
+    def _sample_obj_pos(self, high, batch_size=16):
+        """ Samples an object position far enough from the goal that the task
+        is not immediately done. Candidates are drawn in batches, the batch is
+        doubled whenever none of them is accepted. """
+        while True:
+            candidates = self.np_random.uniform(
+                self.table_low, high, size=(batch_size, 3))
+            candidates[:, 2] = self.height_offset
+            d2 = ((candidates - self.goal)**2).sum(axis=1)
+            accepted = np.flatnonzero(d2 >= 0.1**2)
+            if accepted.size:
+                return candidates[accepted[0]]
+            batch_size *= 2
+
     def _sample_goal(self):
         if self.fixed_goal:
             if self.target_in_the_air:
@@ -236,45 +338,25 @@ class MicoEnv(BulletRobotEnv):
         if self.target_in_the_air and self.np_random.uniform() < 1:
             goal[2] += self.np_random.uniform(0, self.table_high[2])
 
-        return goal.copy()
+        return goal
 
     def draw_goal(self):
         self.p.resetBasePositionAndOrientation(self.visualizeTarget, self.goal,
                                                [0, 0, 0, 1])
 
     def _is_success(self, _):
-        grip_state = self.p.getLinkState(
-            self.arm.armId, 6, computeLinkVelocity=1)
-        grip_pos = np.array(grip_state[0])
-        d = goal_distance(grip_pos, self.goal)
-        if self.has_object:
-            obj_pos = np.array(
-                self.p.getBasePositionAndOrientation(self.body)[0])
-
-            d = goal_distance(obj_pos, self.goal)
-        return d < self.distance_threshold
+        return self._step_metrics()[1]
 
     def _env_setup(self, initial_qpos):
         while not self._reset_sim():
             pass
 
     def _get_reward(self):
-        grip_state = self.p.getLinkState(
-            self.arm.armId, 6, computeLinkVelocity=1)
-        grip_pos = np.array(grip_state[0])
-        if self.has_object:
-            obj_pos = np.array(
-                self.p.getBasePositionAndOrientation(self.body)[0])
-
-            r = self.compute_reward(obj_pos, self.goal)
-        else:
-            r = self.compute_reward(grip_pos, self.goal)
-        return r
+        return self._step_metrics()[0]
 
     def init_arm(self):
-        reach_low = np.array(self.table_low)
-        reach_high = np.array(self.table_high)
-        reach_low, reach_high = reach_low - 0.2, reach_high + 0.2
+        # The arithmetic creates new arrays, so the table bounds are untouched.
+        reach_low, reach_high = self.table_low - 0.2, self.table_high + 0.2
         reach_low[2] = 0.05
         spawn_pos = [0, 0, 0]
         if self.randomizeArm:
@@ -329,72 +411,72 @@ class MicoEnv(BulletRobotEnv):
             "plane.urdf", [0, 0, 0], self.p.getQuaternionFromEuler([0, 0, 0]))
 
         if self.randomizeCamera:
-            x = np.random.normal(-1.05, 0.04, 1)
-            z = np.random.normal(0.68, 0.04, 1)
-            lookat_x = np.random.normal(0.1, 0.02, 1)
+            x = random.gauss(-1.05, 0.04)
+            z = random.gauss(0.68, 0.04)
+            lookat_x = random.gauss(0.1, 0.02)
             pos = [x, 0, z]
             lookat = [lookat_x, 0, 0]
             vec = [-0.5, 0, 1]
             self.viewMatrix = self.p.computeViewMatrix(pos, lookat, vec)
-            fov = np.random.normal(45, 2, 1)
+            fov = random.gauss(45, 2)
             self.projMatrix = self.p.computeProjectionMatrixFOV(
                 fov=fov, aspect=4. / 3., nearVal=0.01, farVal=2.5)
 
             direction = np.array([
-                np.random.choice([
-                    np.random.random_integers(-20, -5),
-                    np.random.random_integers(5, 20),
+                random.choice([
+                    random.randint(-20, -5),
+                    random.randint(5, 20),
                 ]),
-                np.random.choice([
-                    np.random.random_integers(-20, -5),
-                    np.random.random_integers(5, 20),
+                random.choice([
+                    random.randint(-20, -5),
+                    random.randint(5, 20),
                 ]),
-                np.random.random_integers(70, 100),
+                random.randint(70, 100),
             ])
 
             self.light = {
-                "diffuse": np.random.uniform(0.4, 0.6),
-                "ambient": np.random.uniform(0.4, 0.6),
-                "spec": np.random.uniform(0.4, 0.7),
+                "diffuse": random.uniform(0.4, 0.6),
+                "ambient": random.uniform(0.4, 0.6),
+                "spec": random.uniform(0.4, 0.7),
                 "dir": direction,
                 "col": np.random.uniform([0.9, 0.9, 0.9], [1, 1, 1]),
             }
         if self.randomizeTextures:
-            from micoenv import perlin_noise as noise
-
-            if self.normalTextures:
-                wood_color = np.random.normal([170, 150, 140], 8)
-                wall_color = np.random.normal([230, 240, 250], 8)
-            else:
-                wood_color = np.random.uniform([100, 100, 100],
-                                               [130, 255, 130])
-                wall_color = np.random.uniform([100, 100, 100],
-                                               [130, 255, 130])
-            tex1 = self.p.loadTexture(
-                noise.createAndSave(
-                    tmp_dir + "/wall-{}.png".format(self.envId),
-                    "cloud",
-                    wall_color,
-                ))
-            tex2 = self.p.loadTexture(
-                noise.createAndSave(
-                    tmp_dir + "/table-{}.png".format(self.envId),
-                    "cloud",
-                    wood_color,
-                ))
+            tex1 = self.p.loadTexture(self.pooled_texture("wall"))
+            tex2 = self.p.loadTexture(self.pooled_texture("table"))
             self.p.changeVisualShape(self.planeId, -1, textureUniqueId=tex2)
             self.p.changeVisualShape(self.wallId, -1, textureUniqueId=tex1)
 
+    def pooled_texture(self, kind):
+        """ Returns a random texture file for kind ("wall" or "table"). New
+        textures are generated until the pool is full, after that the existing
+        files are reused. Texture ids do not survive resetSimulation, so the
+        pool keeps files rather than loaded textures. """
+        pool = self.texturePool[kind]
+        if len(pool) >= self.texturePoolSize:
+            return pool[np.random.randint(len(pool))]
+        if self.normalTextures:
+            if kind == "wall":
+                color = np.random.normal([230, 240, 250], 8)
+            else:
+                color = np.random.normal([170, 150, 140], 8)
+        else:
+            color = np.random.uniform([100, 100, 100], [130, 255, 130])
+        # Whole color values are as fine as the generated palette anyway.
+        fn = _noise_texture("cloud", tuple(int(c) for c in np.round(color)))
+        pool.append(fn)
+        return fn
+
     def get_state(self):
         return self.state_vector()
 
     def get_aux(self):
-        grip_state = self.p.getLinkState(
-            self.arm.armId, 6, computeLinkVelocity=1)
-        return np.concatenate([
-            self.arm.get_joint_poses(),
-            np.array(grip_state[0]), self.arm.goalPosition
-        ])
+        buf = self._aux_buf
+        buf[0:10] = self.arm.get_joint_poses()
+        buf[10:13] = self._grip_state()[0]
+        buf[13:16] = self.arm.goalPosition
+        # Like the states, auxiliary observations are kept in the memory.
+        return buf.copy()
 
     def store_state(self, fn):
         self.p.saveBullet(fn)